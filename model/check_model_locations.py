@@ -6,6 +6,23 @@ Check where ESM model is located (PyTorch Hub vs Hugging Face)
 import os
 from pathlib import Path
 
+def _scan(root):
+    """Walk a directory tree once, bucketing model files by type"""
+    out = {"st": [], "bin": [], "cfg": []}
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(".safetensors"):
+                    out["st"].append(entry)
+                elif entry.name.endswith(".bin"):
+                    out["bin"].append(entry)
+                elif entry.name == "config.json":
+                    out["cfg"].append(entry)
+    return out
+
 def check_model_locations():
     """Check both PyTorch Hub and Hugging Face cache locations"""
     
@@ -41,15 +58,16 @@ def check_model_locations():
         for model_dir in model_dirs:
             print(f"   📁 {model_dir.name}")
             
-            # Check for model files
-            safetensors_files = list(model_dir.rglob("*.safetensors"))
-            pytorch_files = list(model_dir.rglob("*.bin"))
-            config_files = list(model_dir.rglob("config.json"))
+            # Check for model files (single walk over the cache subtree)
+            found = _scan(model_dir)
+            safetensors_files = found["st"]
+            pytorch_files = found["bin"]
+            config_files = found["cfg"]
             
             total_size = 0
             if safetensors_files:
                 for f in safetensors_files:
-                    size_gb = f.stat().st_size / (1024**3)
+                    size_gb = f.stat().st_size / (1024**3)  # DirEntry caches the stat
                     total_size += size_gb
                     print(f"      📄 {f.name}: {size_gb:.2f} GB")
             
@@ -6,40 +6,123 @@ to avoid 403 errors from the ESM library.
 """
 
 import os
+import io
+import hashlib
 import urllib.request
 import urllib.error
 import shutil
 from pathlib import Path
 from tqdm import tqdm
 
-def download_file(url: str, dest_path: str, chunk_size: int = 8192):
+# 1 MB reads keep the Python-side copy loop off the critical path on fast links
+CHUNK_SIZE = 1 << 20
+
+# Optional known-good digest of esm2_t33_650M_UR50D.pt (hex). When unset, the
+# digest of the first complete download is recorded next to the file instead,
+# and an existing model is checked against that record before being reused.
+EXPECTED_SHA256 = os.environ.get("ESM_MODEL_SHA256", "").lower()
+
+def _hash_existing(path: str, sha256) -> int:
+    """Feed an existing partial download into the hash, return its size"""
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+            size += len(chunk)
+    return size
+
+class _ProgressWriter(io.BufferedWriter):
+    """Buffered file writer that reports progress (and optionally hashes) on each write"""
+    
+    def __init__(self, path: str, mode: str, pbar, sha256=None):
+        super().__init__(io.FileIO(path, mode), buffer_size=CHUNK_SIZE)
+        self.pbar = pbar
+        self.sha256 = sha256
+    
+    def write(self, b):
+        n = super().write(b)
+        if self.sha256 is not None:
+            self.sha256.update(b)
+        self.pbar.update(n)
+        return n
+
+def download_file(url: str, dest_path: str, chunk_size: int = CHUNK_SIZE):
     """Download a file with progress bar"""
     try:
         # Create directory if it doesn't exist
         os.makedirs(os.path.dirname(dest_path), exist_ok=True)
         
-        # Get file size for progress bar
+        # Download with progress bar (Content-Length sizes the bar, if present)
         with urllib.request.urlopen(url) as response:
             total_size = int(response.headers.get('Content-Length', 0))
-        
-        # Download with progress bar
-        with urllib.request.urlopen(url) as response, open(dest_path, 'wb') as out_file:
-            if total_size > 0:
-                with tqdm(total=total_size, unit='B', unit_scale=True, desc="Downloading") as pbar:
-                    while True:
-                        chunk = response.read(chunk_size)
-                        if not chunk:
-                            break
-                        out_file.write(chunk)
-                        pbar.update(len(chunk))
-            else:
-                shutil.copyfileobj(response, out_file)
+            with tqdm(total=total_size or None, unit='B', unit_scale=True, desc="Downloading") as pbar:
+                with _ProgressWriter(dest_path, 'wb', pbar) as out_file:
+                    shutil.copyfileobj(response, out_file, length=chunk_size)
         
         return True
     except Exception as e:
         print(f"Error downloading: {e}")
         return False
 
+def _verify_existing(model_file: str) -> bool:
+    """Check a previously downloaded model against the expected or recorded SHA256"""
+    sidecar = model_file + ".sha256"
+    expected = EXPECTED_SHA256
+    if not expected and os.path.exists(sidecar):
+        with open(sidecar) as f:
+            expected = f.read().strip().lower()
+    sha256 = hashlib.sha256()
+    size = _hash_existing(model_file, sha256)
+    digest = sha256.hexdigest()
+    if expected:
+        return digest == expected
+    # No digest to compare against: fall back to the size check and record this one
+    if size <= 1000000000:
+        return False
+    with open(sidecar, 'w') as f:
+        f.write(digest + "\n")
+    return True
+
+def _download_part(model_url: str, part_file: str, user_agent: str) -> str:
+    """Download (or resume) model_url into part_file, return the SHA256 of the whole file"""
+    # Resume from a previous partial download if there is one
+    sha256 = hashlib.sha256()
+    pos = _hash_existing(part_file, sha256) if os.path.exists(part_file) else 0
+    
+    # Create request with user agent
+    req = urllib.request.Request(model_url)
+    req.add_header('User-Agent', user_agent)
+    if pos > 0:
+        print(f"   Resuming from {pos / (1024**3):.2f} GB")
+        req.add_header('Range', f'bytes={pos}-')
+    
+    try:
+        response = urllib.request.urlopen(req)
+    except urllib.error.HTTPError as e:
+        if e.code == 416 and pos > 0:
+            # Partial file is larger than the remote one - discard and restart in this attempt
+            print("❌ Partial download is invalid, starting over")
+            os.remove(part_file)
+            return _download_part(model_url, part_file, user_agent)
+        raise
+    
+    with response:
+        if pos > 0 and response.status != 206:
+            # Server ignored the Range header - start over
+            print("   Server does not support resume, restarting download")
+            pos = 0
+            sha256 = hashlib.sha256()
+        
+        total_size = int(response.headers.get('Content-Length', 0))
+        with tqdm(total=pos + total_size if total_size > 0 else None, initial=pos,
+                  unit='B', unit_scale=True, desc="Downloading") as pbar:
+            with _ProgressWriter(part_file, 'ab' if pos > 0 else 'wb', pbar, sha256) as out_file:
+                shutil.copyfileobj(response, out_file, length=CHUNK_SIZE)
+    return sha256.hexdigest()
+
 def download_esm_model():
     """Download ESM2 model directly"""
     model_url = "https://dl.fbaipublicfiles.com/fair-esm/models/facebook/esm2_t33_650M_UR50D.pt"
@@ -50,12 +133,15 @@ def download_esm_model():
     
     model_file = os.path.join(cache_dir, "esm2_t33_650M_UR50D.pt")
     
-    # Check if already downloaded
+    # Check if already downloaded (and still matches its checksum)
     if os.path.exists(model_file):
-        size_gb = os.path.getsize(model_file) / (1024**3)
-        print(f"✅ Model already exists at: {model_file}")
-        print(f"   Size: {size_gb:.2f} GB")
-        return model_file
+        if _verify_existing(model_file):
+            size_gb = os.path.getsize(model_file) / (1024**3)
+            print(f"✅ Model already exists at: {model_file}")
+            print(f"   Size: {size_gb:.2f} GB")
+            return model_file
+        print(f"❌ Existing model at {model_file} failed verification, downloading again")
+        os.remove(model_file)
     
     print("📥 Downloading ESM2 model...")
     print(f"   URL: {model_url}")
@@ -70,40 +156,33 @@ def download_esm_model():
         "Python-urllib/3.10",
     ]
     
+    part_file = model_file + ".part"
+    
     for i, user_agent in enumerate(user_agents, 1):
         try:
             print(f"\nAttempt {i}/{len(user_agents)}: Using user agent...")
             
-            # Create request with user agent
-            req = urllib.request.Request(model_url)
-            req.add_header('User-Agent', user_agent)
-            
-            # Download
-            with urllib.request.urlopen(req) as response, open(model_file, 'wb') as out_file:
-                total_size = int(response.headers.get('Content-Length', 0))
-                
-                if total_size > 0:
-                    with tqdm(total=total_size, unit='B', unit_scale=True, desc="Downloading") as pbar:
-                        while True:
-                            chunk = response.read(8192)
-                            if not chunk:
-                                break
-                            out_file.write(chunk)
-                            pbar.update(len(chunk))
-                else:
-                    shutil.copyfileobj(response, out_file)
+            digest = _download_part(model_url, part_file, user_agent)
             
             # Verify download
-            if os.path.exists(model_file) and os.path.getsize(model_file) > 1000000000:  # > 1GB
+            if EXPECTED_SHA256 and digest != EXPECTED_SHA256:
+                print(f"❌ Checksum mismatch (got {digest}), file is corrupted")
+                os.remove(part_file)
+                continue
+            
+            if os.path.getsize(part_file) > 1000000000:  # > 1GB
+                os.rename(part_file, model_file)
+                with open(model_file + ".sha256", 'w') as f:
+                    f.write(digest + "\n")
                 size_gb = os.path.getsize(model_file) / (1024**3)
                 print(f"\n✅ Model downloaded successfully!")
                 print(f"   Location: {model_file}")
                 print(f"   Size: {size_gb:.2f} GB")
+                print(f"   SHA256: {digest}")
                 return model_file
             else:
                 print("❌ Downloaded file is too small, may be corrupted")
-                if os.path.exists(model_file):
-                    os.remove(model_file)
+                os.remove(part_file)
                     
         except urllib.error.HTTPError as e:
             if e.code == 403:
@@ -0,0 +1,79 @@
+"""
+Export the trained PPI model to ONNX for the CPU inference path
+ml_service.py serves ppi.onnx (or ppi.int8.onnx on VNNI CPUs) through ONNX Runtime
+when no GPU is available
+"""
+
+import logging
+import os
+import tempfile
+
+import torch
+
+from ml_service import PPIPredictor, fold_batchnorm
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def export_onnx(model_path: str = "model.pth", onnx_path: str = "ppi.onnx", opset_version: int = 17):
+    """Export the BN-folded PPI model with a dynamic batch dimension"""
+    checkpoint = torch.load(model_path, map_location="cpu")
+    model = PPIPredictor(input_dim=2560)
+    model.load_state_dict(checkpoint['model_state_dict'])
+    model.eval()
+    model = fold_batchnorm(model)
+
+    torch.onnx.export(
+        model,
+        torch.randn(1, 2560),
+        onnx_path,
+        input_names=["input"],
+        output_names=["binary_logit", "type_logits"],
+        dynamic_axes={
+            "input": {0: "batch"},
+            "binary_logit": {0: "batch"},
+            "type_logits": {0: "batch"}
+        },
+        opset_version=opset_version
+    )
+    logger.info(f"Exported ONNX model to {onnx_path}")
+    return onnx_path
+
+
+def quantize_onnx(onnx_path: str = "ppi.onnx", int8_path: str = "ppi.int8.onnx"):
+    """Dynamically quantize the Linear layers to INT8 (weights int8, activations quantized per call)"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    # Re-run shape inference first; the quantizer rejects some exporter-emitted value_info
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        prep_path = os.path.join(tmp_dir, "ppi.prep.onnx")
+        quant_pre_process(onnx_path, prep_path)
+        quantize_dynamic(prep_path, int8_path, weight_type=QuantType.QInt8)
+    logger.info(f"Exported INT8 ONNX model to {int8_path}")
+    return int8_path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export PPI model to ONNX")
+    parser.add_argument("--model_path", type=str, default="model.pth",
+                       help="Path to trained model file")
+    parser.add_argument("--onnx_path", type=str, default="ppi.onnx",
+                       help="Path to write the ONNX model")
+    parser.add_argument("--opset_version", type=int, default=17,
+                       help="ONNX opset version")
+    parser.add_argument("--int8_path", type=str, default="ppi.int8.onnx",
+                       help="Path to write the INT8 ONNX model (empty to skip)")
+
+    args = parser.parse_args()
+
+    export_onnx(
+        model_path=args.model_path,
+        onnx_path=args.onnx_path,
+        opset_version=args.opset_version
+    )
+    if args.int8_path:
+        quantize_onnx(args.onnx_path, args.int8_path)
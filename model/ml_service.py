@@ -6,12 +6,19 @@ Handles /ping and /invocations endpoints for SageMaker deployment
 import json
 import logging
 import os
-import pickle
+import queue
+import sqlite3
+import functools
+import threading
+import time
+from concurrent.futures import Future
 import torch
 import torch.nn as nn
 import requests
+from requests.adapters import HTTPAdapter
 from typing import Dict, List, Optional, Tuple
 import numpy as np
+from collections.abc import MutableMapping
 
 # Try to import ESM
 try:
@@ -21,9 +28,129 @@ except ImportError:
     ESM_AVAILABLE = False
     print("Warning: ESM not available. Install with: pip install fair-esm")
 
+# ONNX Runtime serves the exported MLP on CPU (see export_onnx.py)
+try:
+    import onnxruntime as ort
+    ORT_AVAILABLE = True
+except ImportError:
+    ORT_AVAILABLE = False
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def _cpu_has_vnni() -> bool:
+    """Whether the CPU has AVX-512 VNNI / AVX-VNNI int8 dot-product instructions (Linux only)"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = next((line for line in f if line.startswith("flags")), "").split()
+        return "avx512_vnni" in flags or "avx_vnni" in flags
+    except OSError:
+        return False
+
+
+# Dynamic batching: concurrent requests arriving within MAX_WAIT_MS are run as one batch
+MAX_BATCH_SIZE = int(os.environ.get("PPI_MAX_BATCH_SIZE", 32))
+MAX_WAIT_MS = float(os.environ.get("PPI_MAX_WAIT_MS", 5))
+
+# Cache-miss sequences per ESM forward
+ESM_BATCH_SIZE = 8
+
+# Batch sizes with a captured CUDA graph of the MLP forward; batches are padded up
+CUDA_GRAPH_BATCH_SIZES = sorted({b for b in (1, 4, 16) if b < MAX_BATCH_SIZE} | {MAX_BATCH_SIZE})
+
+INTERACTION_TYPES = ["binding", "regulatory", "catalytic", "structural", "other"]
+
+# UniProt lookups: pooled keep-alive session, in-memory LRU, and an SQLite cache
+# that survives restarts
+SEQUENCE_CACHE_PATH = os.environ.get("PPI_SEQUENCE_CACHE", "/opt/ml/model/seq_cache.sqlite")
+
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32))
+
+
+def _read_sequence_cache(uniprot_id: str) -> Optional[str]:
+    """Look up a sequence in the on-disk cache"""
+    try:
+        with sqlite3.connect(SEQUENCE_CACHE_PATH) as conn:
+            row = conn.execute("SELECT sequence FROM sequences WHERE uniprot_id = ?",
+                               (uniprot_id,)).fetchone()
+        return row[0] if row else None
+    except sqlite3.Error:
+        return None
+
+
+def _write_sequence_cache(uniprot_id: str, sequence: str):
+    """Store a sequence in the on-disk cache (best effort)"""
+    try:
+        with sqlite3.connect(SEQUENCE_CACHE_PATH) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS sequences "
+                         "(uniprot_id TEXT PRIMARY KEY, sequence TEXT NOT NULL)")
+            conn.execute("INSERT OR REPLACE INTO sequences VALUES (?, ?)", (uniprot_id, sequence))
+    except sqlite3.Error as e:
+        logger.debug(f"Could not write sequence cache: {e}")
+
+
+@functools.lru_cache(maxsize=8192)
+def fetch_protein_sequence(uniprot_id: str) -> str:
+    """Fetch a sequence from UniProt; raises on failure so misses are not memoized"""
+    sequence = _read_sequence_cache(uniprot_id)
+    if sequence is None:
+        url = f"https://rest.uniprot.org/uniprotkb/{uniprot_id}.fasta"
+        response = _session.get(url, timeout=10)
+        response.raise_for_status()
+        lines = response.text.strip().split('\n')
+        sequence = ''.join(lines[1:])
+        _write_sequence_cache(uniprot_id, sequence)
+    return sequence
+
+class EmbeddingStore(MutableMapping):
+    """
+    protein_id -> embedding over the memmap written by train_model.save_embeddings
+    
+    int8 rows are dequantized with their per-row scale only when accessed, so
+    unused rows are never paged in. Embeddings added at runtime live in memory.
+    """
+    
+    def __init__(self, path: str):
+        with open(path + ".json") as f:
+            index = json.load(f)
+        ids = index["ids"]
+        self.row_of = {pid: i for i, pid in enumerate(ids)}
+        self.extra = {}
+        self.rows = None
+        self.scale = None
+        if ids:
+            shape = (len(ids), index["dim"])
+            self.rows = np.memmap(path, dtype=np.dtype(index["dtype"]), mode="r", shape=shape)
+            if index["dtype"] == "int8":
+                self.scale = np.fromfile(path + ".scale", dtype=np.float16).astype(np.float32)
+    
+    def __getitem__(self, protein_id):
+        if protein_id in self.extra:
+            return self.extra[protein_id]
+        row = self.row_of[protein_id]
+        values = self.rows[row].astype(np.float32)
+        if self.scale is not None:
+            values *= self.scale[row]
+        return torch.from_numpy(values)
+    
+    def __setitem__(self, protein_id, embedding):
+        self.extra[protein_id] = embedding
+    
+    def __delitem__(self, protein_id):
+        del self.extra[protein_id]
+    
+    def __contains__(self, protein_id):
+        return protein_id in self.extra or protein_id in self.row_of
+    
+    def __iter__(self):
+        yield from self.row_of
+        yield from (pid for pid in self.extra if pid not in self.row_of)
+    
+    def __len__(self):
+        return len(self.row_of) + sum(1 for pid in self.extra if pid not in self.row_of)
+
+
 # Model architecture (must match train_model.py)
 class PPIPredictor(nn.Module):
     """Neural network for predicting protein-protein interactions"""
@@ -43,69 +170,129 @@ class PPIPredictor(nn.Module):
             prev_dim = hidden_dim
         
         self.feature_extractor = nn.Sequential(*layers)
+        # Emits a logit; the sigmoid is fused into BCEWithLogitsLoss / applied at inference
         self.binary_classifier = nn.Sequential(
-            nn.Linear(prev_dim, 1),
-            nn.Sigmoid()
+            nn.Linear(prev_dim, 1)
         )
+        # Emits logits; softmax is only needed for the reported confidence
         self.type_classifier = nn.Sequential(
-            nn.Linear(prev_dim, num_interaction_types),
-            nn.Softmax(dim=1)
+            nn.Linear(prev_dim, num_interaction_types)
         )
     
     def forward(self, x):
         features = self.feature_extractor(x)
-        binary_prob = self.binary_classifier(features)
+        binary_logit = self.binary_classifier(features)
         interaction_type = self.type_classifier(features)
-        return binary_prob, interaction_type
+        return binary_logit, interaction_type
+
+
+def fold_batchnorm(model: PPIPredictor) -> PPIPredictor:
+    """Fold each eval-mode BatchNorm1d into the preceding Linear and replace it with Identity"""
+    layers = model.feature_extractor
+    for i in range(1, len(layers)):
+        linear, bn = layers[i - 1], layers[i]
+        if not (isinstance(linear, nn.Linear) and isinstance(bn, nn.BatchNorm1d)):
+            continue
+        with torch.no_grad():
+            scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+            linear.weight.mul_(scale.unsqueeze(1))
+            linear.bias.copy_((linear.bias - bn.running_mean) * scale + bn.bias)
+        layers[i] = nn.Identity()
+    return model
 
 
 class PPIPredictionService:
     """Service for predicting protein-protein interactions"""
     
     def __init__(self, model_path: str = "/opt/ml/model/model.pth", 
-                 embeddings_cache_path: str = "/opt/ml/model/embeddings_cache.pkl",
-                 device: str = "cuda" if torch.cuda.is_available() else "cpu"):
+                 embeddings_cache_path: str = "/opt/ml/model/embeddings_cache.mmap",
+                 device: str = "cuda" if torch.cuda.is_available() else "cpu",
+                 onnx_path: str = "/opt/ml/model/ppi.onnx"):
         """
         Initialize the PPI prediction service
         
         For SageMaker deployment:
         - model_path: Should be /opt/ml/model/model.pth (SageMaker standard)
-        - embeddings_cache_path: Should be /opt/ml/model/embeddings_cache.pkl
+        - embeddings_cache_path: Should be /opt/ml/model/embeddings_cache.mmap (+ .json index, .scale for int8)
         - Model files are provided by SageMaker from S3
         
         Args:
             model_path: Path to trained model file
             embeddings_cache_path: Path to embeddings cache file
             device: Device to run inference on (cuda/cpu)
+            onnx_path: Exported ONNX model, served with ONNX Runtime on CPU if present
+                (the .int8.onnx sibling is preferred on VNNI CPUs)
         """
         self.device = device
+        # Half precision on GPU (tensor cores, half the bytes); CPU stays FP32
+        self.dtype = torch.float16 if device == "cuda" else torch.float32
         logger.info(f"Initializing PPI Prediction Service on {device}")
         
-        # Load embeddings cache
-        if os.path.exists(embeddings_cache_path):
+        # Load embeddings cache; the .json index is written last, so it marks a complete cache
+        if os.path.exists(embeddings_cache_path + ".json"):
             logger.info(f"Loading embeddings cache from {embeddings_cache_path}")
-            with open(embeddings_cache_path, 'rb') as f:
-                self.embeddings_cache = pickle.load(f)
+            self.embeddings_cache = EmbeddingStore(embeddings_cache_path)
         else:
             logger.warning(f"Embeddings cache not found at {embeddings_cache_path}")
             self.embeddings_cache = {}
+        # Embeddings computed on-the-fly are added to the cache from request threads
+        self._cache_lock = threading.Lock()
         
         # Load model
         if os.path.exists(model_path):
             logger.info(f"Loading model from {model_path}")
-            checkpoint = torch.load(model_path, map_location=device)
+            # Memory-map the checkpoint on CPU: pickled extras (e.g. an embeddings dict from
+            # older training runs) are never paged in or copied to the GPU
+            try:
+                checkpoint = torch.load(model_path, map_location="cpu", mmap=True)
+            except TypeError:  # torch < 2.1 has no mmap
+                checkpoint = torch.load(model_path, map_location="cpu")
             
             # Initialize model
             self.model = PPIPredictor(input_dim=2560)
             self.model.load_state_dict(checkpoint['model_state_dict'])
-            self.model = self.model.to(device)
             self.model.eval()
+            # Fold BN in FP32 before the cast so the fused weights don't lose precision
+            self.model = fold_batchnorm(self.model).to(device, self.dtype)
+            
+            if device == "cuda":
+                # Inductor fuses Linear+BN+ReLU into a few kernels; CUDA graphs are captured
+                # separately per batch size in _capture_cuda_graphs (which also warms up codegen).
+                # Default mode exists on torch 2.0 and skips GEMM autotuning, keeping model_fn
+                # cold start short; any compile failure falls back to the eager model
+                try:
+                    self.model = torch.compile(self.model, mode="default", fullgraph=True, dynamic=False)
+                except Exception as e:
+                    logger.warning(f"torch.compile unavailable, running the MLP eagerly: {e}")
+            else:
+                # Script + freeze into a fused TorchScript graph so the MLP runs without
+                # per-layer Python dispatch
+                self.model = torch.jit.optimize_for_inference(torch.jit.freeze(torch.jit.script(self.model)))
+                
+                # Warm up: the profiling executor specializes on the first calls
+                with torch.inference_mode():
+                    dummy = torch.zeros(1, 2560, device=device, dtype=self.dtype)
+                    for _ in range(2):
+                        self.model(dummy)
             
             logger.info("Model loaded successfully")
         else:
             logger.error(f"Model not found at {model_path}")
             raise FileNotFoundError(f"Model file not found: {model_path}")
         
+        # On CPU prefer ONNX Runtime's fused AVX2/AVX-512 kernels over PyTorch dispatch
+        self.ort_session = None
+        # INT8 model from export_onnx.py only pays off with VNNI dot-product instructions
+        int8_path = os.path.splitext(onnx_path)[0] + ".int8.onnx"
+        if os.path.exists(int8_path) and _cpu_has_vnni():
+            onnx_path = int8_path
+        if device == "cpu" and ORT_AVAILABLE and os.path.exists(onnx_path):
+            sess_options = ort.SessionOptions()
+            sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            sess_options.intra_op_num_threads = os.cpu_count()
+            self.ort_session = ort.InferenceSession(onnx_path, sess_options, providers=["CPUExecutionProvider"])
+            logger.info(f"Serving MLP with ONNX Runtime from {onnx_path}")
+        
         # Load ESM model for computing embeddings on-the-fly if needed
         if ESM_AVAILABLE:
             try:
@@ -113,7 +300,7 @@ class PPIPredictionService:
                 self.esm_model, self.esm_alphabet = esm.pretrained.load_model_and_alphabet_hub(
                     "facebook/esm2_t33_650M_UR50D"
                 )
-                self.esm_model = self.esm_model.to(device)
+                self.esm_model = self.esm_model.to(device, self.dtype)
                 self.esm_model.eval()
                 self.esm_batch_converter = self.esm_alphabet.get_batch_converter()
                 self.esm_available = True
@@ -122,54 +309,129 @@ class PPIPredictionService:
                 self.esm_available = False
         else:
             self.esm_available = False
+        
+        # Reused model input buffer: pairs are copied in place, no per-batch cat/stack allocations
+        self._batch_buf = torch.zeros((MAX_BATCH_SIZE, 2560), device=device, dtype=self.dtype)
+        
+        # Replay the MLP as CUDA graphs: one launch instead of one per layer
+        self._graphs = {}
+        if device == "cuda":
+            self._capture_cuda_graphs()
+        
+        # Start the dynamic batching worker
+        self._requests = queue.Queue()
+        self._worker = threading.Thread(target=self._batch_loop, daemon=True)
+        self._worker.start()
     
     def get_protein_sequence(self, uniprot_id: str) -> Optional[str]:
-        """Fetch protein sequence from UniProt API"""
+        """Fetch protein sequence from UniProt API (cached)"""
         try:
-            url = f"https://www.uniprot.org/uniprot/{uniprot_id}.fasta"
-            response = requests.get(url, timeout=10)
-            if response.status_code == 200:
-                lines = response.text.strip().split('\n')
-                sequence = ''.join(lines[1:])
-                return sequence
-            return None
+            return fetch_protein_sequence(uniprot_id)
         except Exception as e:
             logger.error(f"Error fetching sequence for {uniprot_id}: {e}")
             return None
     
+    def _capture_cuda_graphs(self):
+        """Capture the MLP forward over slices of the input buffer for fixed batch sizes"""
+        try:
+            # Warm up on a side stream before capture, as CUDA graphs require
+            stream = torch.cuda.Stream()
+            stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(stream), torch.no_grad():
+                for batch_size in CUDA_GRAPH_BATCH_SIZES:
+                    for _ in range(3):
+                        self.model(self._batch_buf[:batch_size])
+            torch.cuda.current_stream().wait_stream(stream)
+            
+            for batch_size in CUDA_GRAPH_BATCH_SIZES:
+                graph = torch.cuda.CUDAGraph()
+                with torch.no_grad(), torch.cuda.graph(graph):
+                    outputs = self.model(self._batch_buf[:batch_size])
+                self._graphs[batch_size] = (graph, outputs)
+            logger.info(f"Captured CUDA graphs for batch sizes {CUDA_GRAPH_BATCH_SIZES}")
+        except Exception as e:
+            self._graphs = {}
+            if hasattr(self.model, "_orig_mod"):
+                # Inductor codegen failed on the first calls; retry with the eager module
+                logger.warning(f"Compiled MLP failed, falling back to eager: {e}")
+                self.model = self.model._orig_mod
+                self._capture_cuda_graphs()
+            else:
+                logger.warning(f"CUDA graph capture failed, running the MLP eagerly: {e}")
+    
     def compute_embedding(self, protein_id: str) -> Optional[torch.Tensor]:
         """Compute or retrieve embedding for a protein"""
+        return self.compute_embeddings([protein_id])[protein_id]
+    
+    def compute_embeddings(self, protein_ids: List[str]) -> Dict[str, torch.Tensor]:
+        """
+        Compute or retrieve embeddings for several proteins
+        
+        Cache misses are embedded together: sequences are sorted by length
+        ("smart batching") and run through ESM in batches of ESM_BATCH_SIZE,
+        so each batch carries little padding.
+        """
+        embeddings = {}
+        missing = []
+        
         # Check cache first
-        if protein_id in self.embeddings_cache:
-            return self.embeddings_cache[protein_id].to(self.device)
+        with self._cache_lock:
+            for protein_id in dict.fromkeys(protein_ids):
+                cached = self.embeddings_cache.get(protein_id)
+                if cached is not None:
+                    embeddings[protein_id] = cached.to(self.device, torch.float32)
+                else:
+                    missing.append(protein_id)
         
         # If not in cache and ESM available, compute on-the-fly
-        if self.esm_available:
-            sequence = self.get_protein_sequence(protein_id)
-            if sequence:
-                if len(sequence) > 1024:
-                    sequence = sequence[:1024]
+        if missing and self.esm_available:
+            sequences = {}
+            for protein_id in missing:
+                sequence = self.get_protein_sequence(protein_id)
+                if sequence:
+                    sequences[protein_id] = sequence[:1024]
+            
+            order = sorted(sequences, key=lambda pid: len(sequences[pid]))
+            for i in range(0, len(order), ESM_BATCH_SIZE):
+                batch_ids = order[i:i + ESM_BATCH_SIZE]
                 
                 # Convert to batch format
-                batch_labels, batch_strs, batch_tokens = self.esm_batch_converter([("", sequence)])
+                batch_labels, batch_strs, batch_tokens = self.esm_batch_converter(
+                    [(pid, sequences[pid]) for pid in batch_ids]
+                )
+                batch_lens = (batch_tokens != self.esm_alphabet.padding_idx).sum(1).tolist()
                 batch_tokens = batch_tokens.to(self.device)
                 
-                # Compute embedding
-                with torch.no_grad():
+                # Compute embeddings
+                with torch.inference_mode(), torch.autocast("cuda", dtype=torch.float16,
+                                                     enabled=self.device == "cuda"):
                     results = self.esm_model(batch_tokens, repr_layers=[33])
                     token_embeddings = results["representations"][33]
-                    embedding = token_embeddings[:, 1:-1, :].mean(dim=1).squeeze(0)
                 
-                return embedding
+                for j, protein_id in enumerate(batch_ids):
+                    # Mean over real residues only (skip BOS, EOS and padding)
+                    embedding = token_embeddings[j, 1:batch_lens[j] - 1].float().mean(dim=0)
+                    embeddings[protein_id] = embedding
+                    
+                    # Keep it so the next request for this protein skips the ESM forward
+                    with self._cache_lock:
+                        self.embeddings_cache[protein_id] = embedding.detach().cpu()
         
-        # Fallback: return zero vector
-        logger.warning(f"Embedding not found for {protein_id}, using zero vector")
-        return torch.zeros(1280).to(self.device)
+        # Fallback: zero vector
+        for protein_id in protein_ids:
+            if protein_id not in embeddings:
+                logger.warning(f"Embedding not found for {protein_id}, using zero vector")
+                embeddings[protein_id] = torch.zeros(1280, device=self.device)
+        
+        return embeddings
     
     def predict(self, protein_a: str, protein_b: str) -> Dict:
         """
         Predict protein-protein interaction
         
+        The request is queued for the batching worker, which runs it together
+        with any other requests that arrive within MAX_WAIT_MS.
+        
         Args:
             protein_a: UniProt ID of first protein
             protein_b: UniProt ID of second protein
@@ -177,24 +439,77 @@ class PPIPredictionService:
         Returns:
             Dictionary with prediction results
         """
-        # Get embeddings
-        emb_a = self.compute_embedding(protein_a)
-        emb_b = self.compute_embedding(protein_b)
-        
-        # Concatenate embeddings
-        combined_emb = torch.cat([emb_a, emb_b]).unsqueeze(0)
-        
-        # Predict
-        with torch.no_grad():
-            binary_prob, interaction_type = self.model(combined_emb)
-            binary_prob = binary_prob.item()
-            interaction_type_probs = interaction_type.squeeze().cpu().numpy()
-        
+        future = Future()
+        self._requests.put((protein_a, protein_b, future))
+        return future.result()
+    
+    def _batch_loop(self):
+        """Worker thread: drain queued requests into batches and run them"""
+        while True:
+            batch = [self._requests.get()]
+            deadline = time.monotonic() + MAX_WAIT_MS / 1000
+            while len(batch) < MAX_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+    
+    def _run_batch(self, batch: List[Tuple[str, str, Future]]):
+        """Run one (B, 2560) forward for a batch of requests and fulfil their futures"""
+        try:
+            # Get embeddings for every protein in the batch at once, then concatenate each pair
+            embeddings = self.compute_embeddings(
+                [protein for protein_a, protein_b, _ in batch for protein in (protein_a, protein_b)]
+            )
+            combined_emb = self._batch_buf[:len(batch)]
+            for i, (protein_a, protein_b, _) in enumerate(batch):
+                combined_emb[i, :1280].copy_(embeddings[protein_a], non_blocking=True)
+                combined_emb[i, 1280:].copy_(embeddings[protein_b], non_blocking=True)
+            
+            # Predict (replaying the smallest captured graph that fits, if any)
+            graph_size = next((b for b in self._graphs if b >= len(batch)), None)
+            with torch.inference_mode():
+                if graph_size is not None:
+                    graph, (binary_out, type_out) = self._graphs[graph_size]
+                    graph.replay()
+                    binary_logits, type_logits = binary_out[:len(batch)], type_out[:len(batch)]
+                elif self.ort_session is not None:
+                    binary_logits, type_logits = (
+                        torch.from_numpy(out) for out in
+                        self.ort_session.run(None, {"input": combined_emb.numpy()})
+                    )
+                else:
+                    binary_logits, type_logits = self.model(combined_emb)
+                binary_probs = torch.sigmoid(binary_logits.float())
+                type_logits = type_logits.float()
+                type_idx = torch.argmax(type_logits, dim=1)
+                type_conf = torch.softmax(type_logits, dim=1).gather(1, type_idx.unsqueeze(1)).squeeze(1)
+                
+                # One device-to-host copy (and sync) for the whole batch instead of one per value
+                results = torch.stack([binary_probs.view(-1), type_idx.float(), type_conf], dim=1).cpu().numpy()
+            
+            for (protein_a, protein_b, future), (binary_prob, predicted_type_idx, type_confidence) in zip(batch, results):
+                future.set_result(self._format_prediction(
+                    protein_a, protein_b,
+                    float(binary_prob),
+                    int(predicted_type_idx),
+                    float(type_confidence)
+                ))
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+    
+    def _format_prediction(self, protein_a: str, protein_b: str,
+                           binary_prob: float, predicted_type_idx: int,
+                           type_confidence: float) -> Dict:
+        """Build the response dictionary for one pair"""
         # Determine interaction type (simplified - you can map to actual types)
-        interaction_types = ["binding", "regulatory", "catalytic", "structural", "other"]
-        predicted_type_idx = np.argmax(interaction_type_probs)
-        predicted_type = interaction_types[predicted_type_idx]
-        type_confidence = float(interaction_type_probs[predicted_type_idx])
+        predicted_type = INTERACTION_TYPES[predicted_type_idx]
         
         # Determine confidence level
         if binary_prob > 0.8:
@@ -230,13 +545,15 @@ def model_fn(model_dir: str):
     logger.info(f"Loading model from {model_dir}")
     
     model_path = os.path.join(model_dir, "model.pth")
-    embeddings_cache_path = os.path.join(model_dir, "embeddings_cache.pkl")
+    embeddings_cache_path = os.path.join(model_dir, "embeddings_cache.mmap")
+    onnx_path = os.path.join(model_dir, "ppi.onnx")
     
     device = "cuda" if torch.cuda.is_available() else "cpu"
     service = PPIPredictionService(
         model_path=model_path,
         embeddings_cache_path=embeddings_cache_path,
-        device=device
+        device=device,
+        onnx_path=onnx_path
     )
     
     return service
@@ -334,5 +651,6 @@ if __name__ == "__main__":
     model_fn(args.model_dir)
     
     # Run Flask app
-    app.run(host="0.0.0.0", port=args.port, debug=False)
+    # Threaded so concurrent requests can be coalesced by the batching worker
+    app.run(host="0.0.0.0", port=args.port, debug=False, threaded=True)
 
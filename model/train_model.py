@@ -5,18 +5,29 @@ Trains a model on HINT dataset to predict protein-protein interactions
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import torch.optim as optim
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, BatchSampler, RandomSampler, SequentialSampler
+from torch.nn.utils.rnn import pad_sequence
 import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, precision_recall_fscore_support, roc_auc_score
-import pickle
+from sklearn.metrics import precision_recall_fscore_support, roc_auc_score
+import copy
+import json
 import os
+import asyncio
+import multiprocessing
+import sqlite3
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 import logging
 from typing import Dict, List, Tuple, Optional
 import requests
+import functools
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from io import StringIO
 
 # Try to import ESM - will fail gracefully if not installed
@@ -27,48 +38,102 @@ except ImportError:
     ESM_AVAILABLE = False
     print("Warning: ESM not installed. Install with: pip install fair-esm")
 
+# aiohttp enables concurrent UniProt fetches; falls back to serial requests
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
+# PyArrow speeds up the HINT TSV parse
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# zstandard enables the compressed FASTA sequence cache; falls back to SQLite
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+# Only the interaction columns are used downstream
+HINT_COLUMNS = ["Uniprot_A", "Uniprot_B"]
+
+# ESM2-650M embedding size
+EMBEDDING_DIM = 1280
+# ESM batches are padded to a multiple of this many tokens, bounding the distinct (B, L) shapes
+ESM_LENGTH_BUCKET = 64
+
+UNIPROT_FASTA_URL = "https://rest.uniprot.org/uniprotkb/{}.fasta"
+UNIPROT_STREAM_URL = "https://rest.uniprot.org/uniprotkb/stream"
+UNIPROT_BATCH_SIZE = 100
+MAX_CONCURRENT_FETCHES = 32
+# Rate-limited / transient UniProt responses are retried with exponential backoff
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_FETCH_RETRIES = 5
+
+SEQUENCE_CACHE_PATH = "sequences.fasta.zst" if ZSTD_AVAILABLE else "sequences.sqlite"
+
+# Shared keep-alive connection pool for threaded UniProt lookups, retrying
+# rate-limited and transient server errors with exponential backoff
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(
+    pool_connections=MAX_CONCURRENT_FETCHES,
+    pool_maxsize=MAX_CONCURRENT_FETCHES,
+    max_retries=Retry(total=MAX_FETCH_RETRIES, backoff_factor=0.5, status_forcelist=RETRY_STATUSES)
+))
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Hugging Face token IDs per sequence, keyed by tokenizer, reused across compute_esm_embeddings calls
+_token_id_cache: Dict[str, Dict[str, torch.Tensor]] = {}
+
+
+def gather_pair_embeddings(emb_table: torch.Tensor, pair_idx: torch.Tensor) -> torch.Tensor:
+    """Build contiguous (B, 2 * dim) pair inputs with a single gather from the embedding table"""
+    return emb_table.index_select(0, pair_idx.reshape(-1)).view(len(pair_idx), -1)
+
 
 class PPIDataset(Dataset):
-    """Dataset for Protein-Protein Interaction prediction"""
+    """Dataset for Protein-Protein Interaction prediction (shared embedding table + pair indices)"""
     
-    def __init__(self, pairs: List[Tuple[str, str]], labels: List[int], 
-                 embeddings_cache: Dict[str, torch.Tensor], 
-                 max_length: int = 1024):
+    def __init__(self, emb_table: torch.Tensor, pair_idx: np.ndarray, labels: np.ndarray):
         """
         Args:
-            pairs: List of (protein_id_A, protein_id_B) tuples
-            labels: List of interaction labels (1 = interacts, 0 = doesn't interact)
-            embeddings_cache: Dictionary mapping protein_id to embedding tensor
-            max_length: Maximum sequence length for embedding
+            emb_table: (num_proteins, dim) embedding table shared by all pairs; indices and
+                labels are kept on its device so batches are gathered there
+            pair_idx: (num_pairs, 2) int32 rows of protein A and B in emb_table
+            labels: uint8 interaction labels (1 = interacts, 0 = doesn't interact)
         """
-        self.pairs = pairs
-        self.labels = labels
-        self.embeddings_cache = embeddings_cache
-        self.max_length = max_length
+        self.emb_table = emb_table.contiguous()
+        self.pair_idx = torch.from_numpy(np.ascontiguousarray(pair_idx, dtype=np.int32)).to(emb_table.device)
+        self.labels = torch.from_numpy(np.ascontiguousarray(labels, dtype=np.uint8)).to(emb_table.device)
     
     def __len__(self):
-        return len(self.pairs)
+        return len(self.labels)
     
     def __getitem__(self, idx):
-        protein_a, protein_b = self.pairs[idx]
-        label = self.labels[idx]
-        
-        # Get embeddings (use zero vector if not found)
-        emb_a = self.embeddings_cache.get(protein_a, torch.zeros(1280))  # ESM2-650M embedding size
-        emb_b = self.embeddings_cache.get(protein_b, torch.zeros(1280))
-        
-        # Concatenate embeddings
-        combined_emb = torch.cat([emb_a, emb_b])
-        
-        return {
-            'embedding': combined_emb,
-            'label': torch.tensor(label, dtype=torch.float32),
-            'protein_a': protein_a,
-            'protein_b': protein_b
-        }
+        # idx is a whole batch of indices from a BatchSampler: one gather per batch, no collate
+        idx = torch.as_tensor(idx, device=self.labels.device)
+        return gather_pair_embeddings(self.emb_table, self.pair_idx[idx]), self.labels[idx]
+
+
+class SeqDataset(Dataset):
+    """Raw (name, sequence) records for ESM embedding; tokenization happens in collate"""
+    
+    def __init__(self, sequences: List[str]):
+        self.sequences = sequences
+    
+    def __len__(self):
+        return len(self.sequences)
+    
+    def __getitem__(self, idx):
+        return "", self.sequences[idx]
 
 
 class PPIPredictor(nn.Module):
@@ -99,82 +164,377 @@ class PPIPredictor(nn.Module):
         self.feature_extractor = nn.Sequential(*layers)
         
         # Binary classification head (interacts or not)
+        # Emits a logit; the sigmoid is fused into BCEWithLogitsLoss / applied at inference
         self.binary_classifier = nn.Sequential(
-            nn.Linear(prev_dim, 1),
-            nn.Sigmoid()
+            nn.Linear(prev_dim, 1)
         )
         
         # Interaction type classifier (optional)
+        # Emits logits; softmax is only needed for the reported confidence
         self.type_classifier = nn.Sequential(
-            nn.Linear(prev_dim, num_interaction_types),
-            nn.Softmax(dim=1)
+            nn.Linear(prev_dim, num_interaction_types)
         )
     
-    def forward(self, x):
+    def forward(self, x, return_type: bool = True):
         features = self.feature_extractor(x)
-        binary_prob = self.binary_classifier(features)
-        interaction_type = self.type_classifier(features)
-        return binary_prob, interaction_type
+        binary_logit = self.binary_classifier(features)
+        # The type head is unsupervised during training; skip it there
+        interaction_type = self.type_classifier(features) if return_type else None
+        return binary_logit, interaction_type
+
+
+def fold_batchnorm(model: PPIPredictor) -> PPIPredictor:
+    """Fold each eval-mode BatchNorm1d into the preceding Linear and replace it with Identity"""
+    layers = model.feature_extractor
+    for i in range(1, len(layers)):
+        linear, bn = layers[i - 1], layers[i]
+        if not (isinstance(linear, nn.Linear) and isinstance(bn, nn.BatchNorm1d)):
+            continue
+        with torch.no_grad():
+            scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+            linear.weight.mul_(scale.unsqueeze(1))
+            linear.bias.copy_((linear.bias - bn.running_mean) * scale + bn.bias)
+        layers[i] = nn.Identity()
+    return model
 
 
 def load_hint_dataset(file_path: str) -> pd.DataFrame:
-    """Load HINT dataset from TSV file"""
+    """Load HINT dataset from TSV file (cached as int32 index pairs in .npz after the first parse)"""
     logger.info(f"Loading HINT dataset from {file_path}")
-    df = pd.read_csv(file_path, sep='\t')
+    npz_path = file_path + ".npz"
+    pairs = None
+    if os.path.exists(npz_path) and os.path.getmtime(npz_path) >= os.path.getmtime(file_path):
+        try:
+            with np.load(npz_path) as cache:
+                pairs, proteins = cache["pairs"], cache["proteins"]
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            logger.warning(f"Ignoring unreadable HINT cache {npz_path}: {e}")
+            pairs = None
+    if pairs is None:
+        if PYARROW_AVAILABLE:
+            df = pd.read_csv(file_path, sep='\t', engine='pyarrow',
+                             usecols=HINT_COLUMNS, dtype_backend='pyarrow')
+        else:
+            df = pd.read_csv(file_path, sep='\t', usecols=HINT_COLUMNS)
+        # Each protein is stored once; interactions become (N, 2) int32 rows into that table
+        codes, proteins = pd.factorize(df[HINT_COLUMNS].to_numpy(dtype=object).ravel())
+        pairs = codes.astype(np.int32).reshape(-1, 2)
+        proteins = np.asarray(proteins, dtype=str)
+        # Written to a temp file and renamed so an interrupted write never leaves a partial cache
+        tmp_path = npz_path + ".tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, pairs=pairs, proteins=proteins)
+            os.replace(tmp_path, npz_path)
+        except OSError as e:
+            logger.warning(f"Could not write HINT cache {npz_path}: {e}")
+    # Categorical columns share the protein table instead of holding one string per row
+    df = pd.DataFrame({col: pd.Categorical.from_codes(pairs[:, i], categories=proteins)
+                       for i, col in enumerate(HINT_COLUMNS)})
     logger.info(f"Loaded {len(df)} protein pairs")
     return df
 
 
-def get_protein_sequence(uniprot_id: str) -> Optional[str]:
-    """Fetch protein sequence from UniProt API"""
+def save_embeddings(embeddings_cache: Dict[str, torch.Tensor], path: str, dtype: str = "int8"):
+    """
+    Save embeddings as one (N, dim) memmap at path plus a JSON id index at path + '.json'
+    
+    dtype "int8" stores symmetric per-row quantized values with float16 scales
+    at path + '.scale'; "float16" stores the rows directly.
+    """
+    ids = list(embeddings_cache)
+    if ids:
+        matrix = torch.stack([embeddings_cache[pid] for pid in ids]).float().cpu()
+        arr = np.memmap(path, dtype=np.dtype(dtype), mode="w+", shape=(len(ids), EMBEDDING_DIM))
+        if dtype == "int8":
+            # Round the scale to float16 first so dequantization uses exactly what is stored
+            scale = (matrix.abs().amax(dim=1) / 127).clamp(min=1e-8).half()
+            arr[:] = torch.round(matrix / scale.float()[:, None]).clamp(-127, 127).to(torch.int8).numpy()
+            scale.numpy().tofile(path + ".scale")
+        else:
+            arr[:] = matrix.half().numpy()
+        arr.flush()
+        del arr
+    else:
+        open(path, 'wb').close()
+    with open(path + ".json", 'w') as f:
+        json.dump({"ids": ids, "dim": EMBEDDING_DIM, "dtype": dtype}, f)
+
+
+def load_embeddings(path: str) -> Dict[str, torch.Tensor]:
+    """Load embeddings written by save_embeddings as views into one float16 matrix"""
+    with open(path + ".json") as f:
+        index = json.load(f)
+    ids = index["ids"]
+    if not ids:
+        return {}
+    shape = (len(ids), index["dim"])
+    if index["dtype"] == "int8":
+        q = np.memmap(path, dtype=np.int8, mode="r", shape=shape)
+        scale = np.fromfile(path + ".scale", dtype=np.float16)
+        # Dequantize straight to float16: half the resident size of a float32 table
+        matrix = torch.from_numpy(q.astype(np.float16) * scale[:, None])
+    else:
+        # Copy-on-write mapping: pages are read lazily and the tensor stays writable
+        matrix = torch.from_numpy(np.memmap(path, dtype=np.float16, mode="c", shape=shape))
+    return {pid: matrix[i] for i, pid in enumerate(ids)}
+
+
+def unique_proteins(df: pd.DataFrame) -> List[str]:
+    """Unique UniProt IDs across both interaction columns, in first-seen order"""
+    if isinstance(df[HINT_COLUMNS[0]].dtype, pd.CategoricalDtype):
+        # Columns from load_hint_dataset: dedup runs over the int codes
+        return pd.unique(pd.concat([df[col] for col in HINT_COLUMNS])).tolist()
+    if PYARROW_AVAILABLE:
+        # Hash-based dedup in Arrow over the string[pyarrow] columns, no per-row Python objects
+        ids = pa.chunked_array([pa.array(df[col]) for col in HINT_COLUMNS])
+        return pc.unique(ids).to_pylist()
+    return pd.unique(pd.concat([df[col] for col in HINT_COLUMNS])).tolist()
+
+
+def _parse_fasta(text: str) -> str:
+    """Return the sequence from a single-record FASTA response"""
+    lines = text.strip().split('\n')
+    return ''.join(lines[1:])  # Skip header line
+
+
+def _parse_fasta_records(text: str) -> Dict[str, str]:
+    """Split a multi-record UniProt FASTA response into {accession: sequence}"""
+    records = {}
+    for record in text.split('>')[1:]:
+        header, _, body = record.partition('\n')
+        # Headers look like "sp|P12345|NAME_HUMAN ..."
+        fields = header.split('|')
+        accession = fields[1] if len(fields) > 2 else header.split()[0]
+        records[accession] = body.replace('\n', '')
+    return records
+
+
+def _stream_query_params(uniprot_ids: List[str]) -> Dict[str, str]:
+    """UniProt stream endpoint parameters fetching a batch of accessions as FASTA"""
+    return {"query": " OR ".join(f"accession:{pid}" for pid in uniprot_ids), "format": "fasta"}
+
+
+def _match_stream_records(uniprot_ids: List[str], text: Optional[str]) -> Tuple[Dict[str, str], List[str]]:
+    """Pick the requested IDs out of a stream response, returning (sequences, IDs still missing)"""
+    records = _parse_fasta_records(text) if text else {}
+    sequences = {pid: records[pid] for pid in uniprot_ids if pid in records}
+    # Isoforms and secondary accessions are not matched by the stream query; the caller
+    # falls back to one request per missing ID
+    missing = [pid for pid in uniprot_ids if pid not in sequences]
+    return sequences, missing
+
+
+def _fetch_sequence_batch(uniprot_ids: List[str]) -> Dict[str, str]:
+    """Fetch up to UNIPROT_BATCH_SIZE sequences in one stream query, falling back per ID"""
+    text = None
     try:
-        url = f"https://www.uniprot.org/uniprot/{uniprot_id}.fasta"
-        response = requests.get(url, timeout=10)
+        response = _session.get(UNIPROT_STREAM_URL, params=_stream_query_params(uniprot_ids), timeout=30)
         if response.status_code == 200:
-            # Parse FASTA format
-            lines = response.text.strip().split('\n')
-            sequence = ''.join(lines[1:])  # Skip header line
-            return sequence
+            text = response.text
         else:
-            logger.warning(f"Failed to fetch sequence for {uniprot_id}: {response.status_code}")
-            return None
+            logger.warning(f"Batch UniProt query failed: {response.status_code}")
+    except Exception as e:
+        logger.error(f"Error in batch UniProt query: {e}")
+    
+    sequences, missing = _match_stream_records(uniprot_ids, text)
+    for pid in missing:
+        seq = get_protein_sequence(pid)
+        if seq:
+            sequences[pid] = seq
+    return sequences
+
+
+@functools.lru_cache(maxsize=8192)
+def _fetch_protein_sequence(uniprot_id: str) -> str:
+    """Fetch a sequence from UniProt; raises on failure so misses are not memoized"""
+    response = _session.get(UNIPROT_FASTA_URL.format(uniprot_id), timeout=10)
+    response.raise_for_status()
+    return _parse_fasta(response.text)
+
+
+def get_protein_sequence(uniprot_id: str) -> Optional[str]:
+    """Fetch protein sequence from UniProt API"""
+    try:
+        return _fetch_protein_sequence(uniprot_id)
+    except requests.HTTPError as e:
+        logger.warning(f"Failed to fetch sequence for {uniprot_id}: {e.response.status_code}")
     except Exception as e:
         logger.error(f"Error fetching sequence for {uniprot_id}: {e}")
-        return None
+    return None
+
+
+async def _get_text_with_backoff(session, url: str, params: Optional[Dict] = None) -> Optional[str]:
+    """GET a UniProt response body, backing off exponentially (or per Retry-After) on 429/5xx"""
+    for attempt in range(MAX_FETCH_RETRIES + 1):
+        async with session.get(url, params=params) as response:
+            if response.status == 200:
+                return await response.text()
+            if response.status not in RETRY_STATUSES or attempt == MAX_FETCH_RETRIES:
+                logger.warning(f"UniProt request failed: {response.status} {response.url}")
+                return None
+            try:
+                delay = float(response.headers.get("Retry-After", ""))
+            except ValueError:
+                delay = 0.5 * 2 ** attempt
+        await asyncio.sleep(delay)
+
+
+async def _fetch_all_async(protein_ids: List[str]) -> Dict[str, str]:
+    """Fetch sequences concurrently over a pooled keep-alive session, 100 IDs per stream query"""
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_FETCHES)
+    timeout = aiohttp.ClientTimeout(total=60)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+    
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def fetch_one(uniprot_id):
+            async with semaphore:
+                try:
+                    text = await _get_text_with_backoff(session, UNIPROT_FASTA_URL.format(uniprot_id))
+                    return _parse_fasta(text) if text else None
+                except Exception as e:
+                    logger.error(f"Error fetching sequence for {uniprot_id}: {e}")
+                    return None
+        
+        async def fetch_batch(uniprot_ids):
+            text = None
+            async with semaphore:
+                try:
+                    text = await _get_text_with_backoff(session, UNIPROT_STREAM_URL,
+                                                        params=_stream_query_params(uniprot_ids))
+                except Exception as e:
+                    logger.error(f"Error in batch UniProt query: {e}")
+            
+            batch, missing = _match_stream_records(uniprot_ids, text)
+            for pid, seq in zip(missing, await asyncio.gather(*(fetch_one(pid) for pid in missing))):
+                if seq:
+                    batch[pid] = seq
+            return batch
+        
+        sequences = {}
+        tasks = [fetch_batch(protein_ids[i:i + UNIPROT_BATCH_SIZE])
+                 for i in range(0, len(protein_ids), UNIPROT_BATCH_SIZE)]
+        for future in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Fetching sequences"):
+            sequences.update(await future)
+        return sequences
+
+
+def _run_async(coro):
+    """asyncio.run that also works inside a notebook's running event loop"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
 
+def _load_zst_fasta(path: str) -> Dict[str, str]:
+    """Read the whole zstd-compressed FASTA sequence cache in one pass"""
+    with open(path, 'rb') as f:
+        text = zstandard.ZstdDecompressor().stream_reader(f).read().decode()
+    return _parse_fasta_records(text)
 
-def generate_negative_samples(positive_pairs: List[Tuple[str, str]], 
+
+def _store_zst_fasta(path: str, sequences: Dict[str, str]):
+    """Rewrite the zstd-compressed FASTA sequence cache atomically"""
+    text = "".join(f">{pid}\n{seq}\n" for pid, seq in sequences.items())
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(zstandard.ZstdCompressor(level=9).compress(text.encode()))
+    os.replace(tmp_path, path)
+
+
+def _load_sequence_cache(path: str) -> Dict[str, str]:
+    """Load cached UniProt sequences from the .fasta.zst or SQLite cache"""
+    if not os.path.exists(path):
+        return {}
+    if path.endswith(".zst"):
+        return _load_zst_fasta(path)
+    with sqlite3.connect(path) as conn:
+        return dict(conn.execute("SELECT uniprot_id, sequence FROM sequences"))
+
+
+def _store_sequence_cache(path: str, sequences: Dict[str, str], cached: Dict[str, str]):
+    """Add fetched UniProt sequences to the .fasta.zst or SQLite cache"""
+    if path.endswith(".zst"):
+        _store_zst_fasta(path, {**cached, **sequences})
+        return
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS sequences "
+                     "(uniprot_id TEXT PRIMARY KEY, sequence TEXT NOT NULL)")
+        conn.executemany("INSERT OR REPLACE INTO sequences VALUES (?, ?)", sequences.items())
+
+
+def fetch_sequences(protein_ids, cache_path: Optional[str] = SEQUENCE_CACHE_PATH) -> Dict[str, str]:
+    """
+    Fetch sequences for a collection of UniProt IDs, skipping failures
+    
+    Previously fetched sequences are read from the cache at cache_path
+    (a zstd-compressed FASTA for .zst paths, SQLite otherwise; None disables it);
+    only missing IDs go to UniProt.
+    """
+    protein_ids = list(protein_ids)
+    cached = _load_sequence_cache(cache_path) if cache_path else {}
+    sequences = {pid: cached[pid] for pid in protein_ids if pid in cached}
+    missing = [pid for pid in protein_ids if pid not in sequences]
+    logger.info(f"{len(sequences)} sequences cached, fetching {len(missing)}")
+    
+    if missing:
+        if AIOHTTP_AVAILABLE:
+            fetched = _run_async(_fetch_all_async(missing))
+        else:
+            fetched = {}
+            batches = [missing[i:i + UNIPROT_BATCH_SIZE] for i in range(0, len(missing), UNIPROT_BATCH_SIZE)]
+            with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_FETCHES) as pool:
+                for batch in tqdm(pool.map(_fetch_sequence_batch, batches), total=len(batches),
+                                  desc="Fetching sequences"):
+                    fetched.update(batch)
+        if cache_path and fetched:
+            _store_sequence_cache(cache_path, fetched, cached)
+        sequences.update(fetched)
+    
+    logger.info(f"Fetched sequences for {len(sequences)} proteins")
+    return sequences
+
+
+def generate_negative_samples(positive_pairs: np.ndarray, 
                              all_proteins: set, 
                              num_negatives: int) -> List[Tuple[str, str]]:
     """Generate negative samples by randomly pairing proteins not in positive set"""
-    negative_pairs = []
-    proteins_list = list(all_proteins)
+    proteins_list = np.array(sorted(all_proteins), dtype=object)
+    num_proteins = len(proteins_list)
     
-    # Create set of positive pairs for fast lookup
-    positive_set = set(positive_pairs)
+    # Encode each order-normalized pair (i < j) as one int64 key: i * P + j
+    pos_idx = pd.Index(proteins_list).get_indexer(np.asarray(positive_pairs, dtype=object).ravel())
+    pos_idx = np.sort(pos_idx.reshape(-1, 2), axis=1).astype(np.int64)
+    positive_keys = np.unique(pos_idx[:, 0] * num_proteins + pos_idx[:, 1])
     
+    negative_keys = np.empty(0, dtype=np.int64)
     attempts = 0
     max_attempts = num_negatives * 10
     
-    while len(negative_pairs) < num_negatives and attempts < max_attempts:
-        # Randomly select two different proteins
-        protein_a = np.random.choice(proteins_list)
-        protein_b = np.random.choice(proteins_list)
+    while len(negative_keys) < num_negatives and attempts < max_attempts:
+        # Draw candidates in bulk, dropping self-pairs and normalizing order
+        n_draw = (num_negatives - len(negative_keys)) * 3
+        idx = np.sort(np.random.randint(0, num_proteins, size=(n_draw, 2)), axis=1).astype(np.int64)
+        idx = idx[idx[:, 0] != idx[:, 1]]
+        keys = idx[:, 0] * num_proteins + idx[:, 1]
+        # positive_keys is sorted (np.unique), so membership is a binary search per candidate
+        # rather than np.isin re-sorting the positives on every draw
+        hits = np.searchsorted(positive_keys, keys).clip(max=max(len(positive_keys) - 1, 0))
+        if len(positive_keys):
+            keys = keys[positive_keys[hits] != keys]
+        attempts += n_draw
         
-        # Ensure they're different
-        if protein_a == protein_b:
-            attempts += 1
-            continue
-        
-        # Create pair (normalize order for comparison)
-        pair = tuple(sorted([protein_a, protein_b]))
-        
-        # Check if this pair is not in positive set
-        if pair not in positive_set and pair not in negative_pairs:
-            negative_pairs.append(pair)
-        
-        attempts += 1
+        # Deduplicate while keeping draw order, so truncation doesn't bias toward small keys
+        keys = np.concatenate([negative_keys, keys])
+        _, first = np.unique(keys, return_index=True)
+        negative_keys = keys[np.sort(first)][:num_negatives]
     
+    # Map indices back to protein IDs only at the end
+    negative_pairs = list(zip(proteins_list[negative_keys // num_proteins],
+                              proteins_list[negative_keys % num_proteins]))
     logger.info(f"Generated {len(negative_pairs)} negative samples")
     return negative_pairs
 
@@ -183,8 +543,15 @@ def compute_esm_embeddings(protein_ids: List[str],
                           sequences: Dict[str, str],
                           model_name: str = "facebook/esm2_t33_650M_UR50D",
                           batch_size: int = 8,
-                          device: str = "cuda" if torch.cuda.is_available() else "cpu") -> Dict[str, torch.Tensor]:
-    """Compute ESM2 embeddings for proteins"""
+                          device: str = "cuda" if torch.cuda.is_available() else "cpu",
+                          hf_model=None,
+                          tokenizer=None) -> Dict[str, torch.Tensor]:
+    """
+    Compute ESM2 embeddings for proteins
+    
+    Each distinct sequence is embedded once and shared by every ID that maps to it.
+    An already-loaded Hugging Face model/tokenizer can be passed to skip reloading.
+    """
     if not ESM_AVAILABLE:
         logger.error("ESM not available. Install with: pip install fair-esm")
         return {}
@@ -204,10 +571,18 @@ def compute_esm_embeddings(protein_ids: List[str],
     logger.info("Priority 1: Attempting to load from Hugging Face transformers...")
     logger.info("   This is the most reliable method - no 403 errors!")
     try:
-        from transformers import EsmModel, EsmTokenizer
-        logger.info("Loading ESM2 from Hugging Face...")
-        hf_model = EsmModel.from_pretrained("facebook/esm2_t33_650M_UR50D")
-        tokenizer = EsmTokenizer.from_pretrained("facebook/esm2_t33_650M_UR50D")
+        if hf_model is None or tokenizer is None:
+            from transformers import EsmModel, EsmTokenizer
+            logger.info("Loading ESM2 from Hugging Face...")
+            try:
+                # Fused scaled_dot_product_attention (Flash / memory-efficient kernels on GPU)
+                hf_model = EsmModel.from_pretrained("facebook/esm2_t33_650M_UR50D",
+                                                    attn_implementation="sdpa")
+            except (TypeError, ValueError):  # transformers without SDPA support for ESM
+                hf_model = EsmModel.from_pretrained("facebook/esm2_t33_650M_UR50D")
+            tokenizer = EsmTokenizer.from_pretrained("facebook/esm2_t33_650M_UR50D")
+        else:
+            logger.info("Using pre-loaded Hugging Face ESM2 model")
         
         logger.info("✅ Hugging Face model loaded successfully!")
         logger.info("   Adapting embedding computation to use Hugging Face API...")
@@ -224,23 +599,30 @@ def compute_esm_embeddings(protein_ids: List[str],
             
             def to(self, device):
                 self.hf_model = self.hf_model.to(device)
+                if device == "cuda" and hasattr(torch, "compile") and not hasattr(self.hf_model, "_orig_mod"):
+                    # Kernel fusion for the 33-layer forward; dynamic=True avoids recompiling per
+                    # length bucket. No CUDA graphs: they would be recorded once per batch shape
+                    self.hf_model = torch.compile(self.hf_model, mode="default",
+                                                  fullgraph=False, dynamic=True)
                 return self
             
             def __call__(self, tokens, repr_layers=None):
                 # tokens is already input_ids from batch_converter
                 # Hugging Face model expects input_ids directly
-                with torch.no_grad():
+                with torch.inference_mode():
                     # tokens might be a tensor or dict - handle both
                     if isinstance(tokens, dict):
                         outputs = self.hf_model(**tokens)
                     else:
-                        outputs = self.hf_model(tokens)
+                        # Mask padding so attention (and the residues' embeddings) ignore it
+                        outputs = self.hf_model(tokens, attention_mask=tokens != self.tokenizer.pad_token_id)
                     hidden_states = outputs.last_hidden_state
                     return {"representations": {33: hidden_states}}
         
         class HuggingFaceAlphabet:
             def __init__(self, tokenizer):
                 self.tokenizer = tokenizer
+                self.padding_idx = tokenizer.pad_token_id
             
             def get_batch_converter(self):
                 return HuggingFaceBatchConverter(self.tokenizer)
@@ -248,19 +630,28 @@ def compute_esm_embeddings(protein_ids: List[str],
         class HuggingFaceBatchConverter:
             def __init__(self, tokenizer):
                 self.tokenizer = tokenizer
+                self.tokenizer.model_max_length = 1024
+                self.seq2tokens = _token_id_cache.setdefault(tokenizer.name_or_path, {})
+            
+            def pretokenize(self, sequences):
+                """Tokenize all sequences in one batched call ahead of the forward loop"""
+                uniq = [seq for seq in dict.fromkeys(sequences) if seq not in self.seq2tokens]
+                if uniq:
+                    encoded = self.tokenizer(uniq, padding=False, truncation=True, max_length=1024)
+                    for seq, ids in zip(uniq, encoded["input_ids"]):
+                        self.seq2tokens[seq] = torch.tensor(ids, dtype=torch.int64)
             
             def __call__(self, batch_sequences):
                 sequences = [seq for _, seq in batch_sequences]
-                encoded = self.tokenizer(
-                    sequences,
-                    padding=True,
-                    truncation=True,
-                    max_length=1024,
-                    return_tensors="pt"
+                # Only sequences not seen before are tokenized; the rest is padding cached IDs
+                self.pretokenize(sequences)
+                tokens = pad_sequence(
+                    [self.seq2tokens[seq] for seq in sequences],
+                    batch_first=True,
+                    padding_value=self.tokenizer.pad_token_id
                 )
                 labels = [name for name, _ in batch_sequences]
                 strs = sequences
-                tokens = encoded["input_ids"]
                 return labels, strs, tokens
         
         model = HuggingFaceESMWrapper(hf_model, tokenizer)
@@ -279,7 +670,7 @@ def compute_esm_embeddings(protein_ids: List[str],
     model_file = os.path.join(cache_dir, "esm2_t33_650M_UR50D.pt")
     
     # Method 2: Try loading from cache (only if Hugging Face failed)
-    if os.path.exists(model_file):
+    if model is None and os.path.exists(model_file):
         logger.info(f"✅ Found cached model at: {model_file}")
         size_gb = os.path.getsize(model_file) / (1024**3)
         logger.info(f"   Size: {size_gb:.2f} GB")
@@ -293,7 +684,6 @@ def compute_esm_embeddings(protein_ids: List[str],
             logger.info("Trying to load model file directly...")
             # Try loading the .pt file directly
             try:
-                import torch
                 state_dict = torch.load(model_file, map_location="cpu")
                 # Note: This is a workaround - esm.pretrained should handle this
                 # If this doesn't work, we'll fall back to other methods
@@ -387,46 +777,87 @@ def compute_esm_embeddings(protein_ids: List[str],
     batch_converter = alphabet.get_batch_converter()
     embeddings = {}
     
-    # Process in batches
-    for i in tqdm(range(0, len(protein_ids), batch_size), desc="Computing embeddings"):
-        batch_ids = protein_ids[i:i+batch_size]
-        batch_sequences = []
-        valid_ids = []
-        
-        for pid in batch_ids:
-            seq = sequences.get(pid)
-            if seq:
-                # Truncate if too long
-                if len(seq) > 1024:
-                    seq = seq[:1024]
-                batch_sequences.append(("", seq))  # ESM expects (name, sequence) tuple
-                valid_ids.append(pid)
-        
-        if not batch_sequences:
-            continue
-        
-        # Convert to batch
+    # Hash index of distinct (truncated) sequences -> protein IDs sharing them
+    seq_to_ids = {}
+    for pid in protein_ids:
+        seq = sequences.get(pid)
+        if seq:
+            seq_to_ids.setdefault(seq[:1024], []).append(pid)
+    # Length-sorted so each batch pads only to similar lengths (attention cost is O(B * L^2))
+    unique_seqs = sorted(seq_to_ids, key=len)
+    logger.info(f"{len(unique_seqs)} distinct sequences to embed")
+    
+    # Token-budget batching: sequences are grouped into length buckets (CLS/EOS included,
+    # rounded up to ESM_LENGTH_BUCKET) and each batch holds as many as fit in the padded-token
+    # budget of batch_size full-length sequences, so short proteins no longer run in tiny
+    # batches and full batches of a bucket share one (B, L) shape
+    max_tokens = batch_size * (1024 + 2)
+    batches, batch_lens = [], []
+    for seq in unique_seqs:
+        bucket_len = -(-(len(seq) + 2) // ESM_LENGTH_BUCKET) * ESM_LENGTH_BUCKET
+        if batches and batch_lens[-1] == bucket_len and len(batches[-1]) < max(max_tokens // bucket_len, 1):
+            batches[-1].append(seq)
+        else:
+            batches.append([seq])
+            batch_lens.append(bucket_len)
+    
+    # Pre-tokenize every unique sequence once, outside the GPU loop
+    if hasattr(batch_converter, "pretokenize"):
+        batch_converter.pretokenize(unique_seqs)
+    
+    def collate(batch_sequences):
+        # batch_sequences are ESM (name, sequence) tuples
         batch_labels, batch_strs, batch_tokens = batch_converter(batch_sequences)
-        batch_tokens = batch_tokens.to(device)
+        # Pad out to the bucket length; pooling and the attention mask both ignore padding
+        bucket_len = -(-batch_tokens.shape[1] // ESM_LENGTH_BUCKET) * ESM_LENGTH_BUCKET
+        batch_tokens = F.pad(batch_tokens, (0, bucket_len - batch_tokens.shape[1]), value=alphabet.padding_idx)
+        return batch_strs, batch_tokens
+    
+    # bf16 autocast halves activation memory for an fp32 model (fair-esm). A model already
+    # loaded in half precision (the notebook's fp16 HF model) runs as-is: autocasting it to
+    # another dtype would re-cast every weight on each batch
+    model_dtype = next(getattr(model, "hf_model", model).parameters()).dtype
+    use_autocast = device == "cuda" and model_dtype == torch.float32
+    amp_dtype = torch.bfloat16 if use_autocast and torch.cuda.is_bf16_supported() else torch.float16
+    
+    # fair-esm's batch converter tokenizes in Python, so loader workers run it for upcoming
+    # batches while the GPU runs the current one. The nested collate/converter don't pickle,
+    # so workers are forked (and skipped where fork is unavailable). The HF path is
+    # pre-tokenized above and collate only pads, which stays in-process
+    use_workers = (device == "cuda" and not hasattr(batch_converter, "pretokenize")
+                   and "fork" in multiprocessing.get_all_start_methods())
+    seq_index = {seq: i for i, seq in enumerate(unique_seqs)}
+    loader = DataLoader(
+        SeqDataset(unique_seqs),
+        batch_sampler=[[seq_index[seq] for seq in batch_seqs] for batch_seqs in batches],
+        collate_fn=collate,
+        num_workers=4 if use_workers else 0,
+        multiprocessing_context="fork" if use_workers else None,
+        pin_memory=(device == "cuda")
+    )
+    for batch_seqs, batch_tokens in tqdm(loader, total=len(batches), desc="Computing embeddings"):
+        batch_tokens = batch_tokens.to(device, non_blocking=True)
         
         # Get embeddings (mean pooling over sequence)
-        with torch.no_grad():
+        with torch.inference_mode(), torch.autocast("cuda", dtype=amp_dtype, enabled=use_autocast):
             results = model(batch_tokens, repr_layers=[33])  # Works for both ESM and Hugging Face wrapper
             token_embeddings = results["representations"][33]
             
-            # Mean pooling (excluding CLS and EOS tokens)
-            # For Hugging Face, CLS is at position 0, EOS at last position
-            # For ESM, similar structure
-            if token_embeddings.shape[1] > 2:
-                # Exclude first (CLS) and last (EOS) tokens
-                sequence_embeddings = token_embeddings[:, 1:-1, :].mean(dim=1)
-            else:
-                # Fallback if sequence is too short
-                sequence_embeddings = token_embeddings.mean(dim=1)
+            # Mean pooling over residues only: CLS is at position 0 and each sequence's EOS
+            # sits right before its padding (same layout for Hugging Face and ESM), so
+            # batching sequences of different lengths doesn't change their embeddings
+            lengths = (batch_tokens != alphabet.padding_idx).sum(dim=1, keepdim=True)
+            positions = torch.arange(batch_tokens.shape[1], device=batch_tokens.device)
+            residue_mask = ((positions >= 1) & (positions < lengths - 1)).unsqueeze(-1)
+            sequence_embeddings = (token_embeddings.float() * residue_mask).sum(dim=1) \
+                / residue_mask.sum(dim=1).clamp(min=1)
         
-        # Store embeddings
-        for j, pid in enumerate(valid_ids):
-            embeddings[pid] = sequence_embeddings[j].cpu()
+        # Store float16 embeddings (one copy to host per batch), fanning out to every ID
+        # with this sequence
+        sequence_embeddings = sequence_embeddings.half().cpu()
+        for j, seq in enumerate(batch_seqs):
+            for pid in seq_to_ids[seq]:
+                embeddings[pid] = sequence_embeddings[j]
     
     logger.info(f"Computed embeddings for {len(embeddings)} proteins")
     return embeddings
@@ -435,15 +866,24 @@ def compute_esm_embeddings(protein_ids: List[str],
 def train_model(
     hint_file: str = "HomoSapiens_binary_hq.txt",
     model_save_path: str = "model.pth",
-    embeddings_cache_path: str = "embeddings_cache.pkl",
+    embeddings_cache_path: str = "embeddings_cache.mmap",
     negative_ratio: float = 1.0,
     test_size: float = 0.2,
     batch_size: int = 32,
     learning_rate: float = 1e-4,
     num_epochs: int = 10,
-    device: str = "cuda" if torch.cuda.is_available() else "cpu"
+    device: str = "cuda" if torch.cuda.is_available() else "cpu",
+    grad_accum_steps: int = 1,
+    precomputed_embeddings: Optional[Dict[str, torch.Tensor]] = None
 ):
-    """Train PPI prediction model on HINT dataset"""
+    """
+    Train PPI prediction model on HINT dataset
+    
+    If precomputed_embeddings is given (protein_id -> embedding), it is used
+    directly instead of loading or computing the embeddings cache.
+    grad_accum_steps > 1 accumulates gradients over that many batches per
+    optimizer step (effective batch = batch_size * grad_accum_steps).
+    """
     
     logger.info("=" * 60)
     logger.info("Starting PPI Model Training")
@@ -453,14 +893,12 @@ def train_model(
     df = load_hint_dataset(hint_file)
     
     # Extract positive pairs
-    positive_pairs = [(row['Uniprot_A'], row['Uniprot_B']) for _, row in df.iterrows()]
+    # (N, 2) object array of IDs straight from the columns; no per-row tuples
+    positive_pairs = df[HINT_COLUMNS].to_numpy(dtype=object)
     logger.info(f"Found {len(positive_pairs)} positive pairs")
     
     # Get all unique proteins
-    all_proteins = set()
-    for pair in positive_pairs:
-        all_proteins.add(pair[0])
-        all_proteins.add(pair[1])
+    all_proteins = set(unique_proteins(df))
     logger.info(f"Found {len(all_proteins)} unique proteins")
     
     # Generate negative samples
@@ -468,26 +906,26 @@ def train_model(
     negative_pairs = generate_negative_samples(positive_pairs, all_proteins, num_negatives)
     
     # Combine positive and negative pairs
-    all_pairs = positive_pairs + negative_pairs
-    all_labels = [1] * len(positive_pairs) + [0] * len(negative_pairs)
+    all_pairs = np.concatenate([positive_pairs, np.asarray(negative_pairs, dtype=object).reshape(-1, 2)])
+    all_labels = np.concatenate([np.ones(len(positive_pairs), dtype=np.uint8),
+                                 np.zeros(len(negative_pairs), dtype=np.uint8)])
     
     logger.info(f"Total pairs: {len(all_pairs)} (pos: {len(positive_pairs)}, neg: {len(negative_pairs)})")
     
     # Load or compute embeddings
-    if os.path.exists(embeddings_cache_path):
+    if precomputed_embeddings is not None:
+        logger.info(f"Using {len(precomputed_embeddings)} precomputed embeddings")
+        embeddings_cache = precomputed_embeddings
+        logger.info(f"Saving embeddings cache to {embeddings_cache_path}")
+        save_embeddings(embeddings_cache, embeddings_cache_path)
+    elif os.path.exists(embeddings_cache_path + ".json"):
+        # The .json index is written last by save_embeddings, so it marks a complete cache
         logger.info(f"Loading embeddings from cache: {embeddings_cache_path}")
-        with open(embeddings_cache_path, 'rb') as f:
-            embeddings_cache = pickle.load(f)
+        embeddings_cache = load_embeddings(embeddings_cache_path)
     else:
         logger.info("Computing embeddings from scratch")
         # Get sequences for all proteins
-        sequences = {}
-        for protein_id in tqdm(all_proteins, desc="Fetching sequences"):
-            seq = get_protein_sequence(protein_id)
-            if seq:
-                sequences[protein_id] = seq
-        
-        logger.info(f"Fetched sequences for {len(sequences)} proteins")
+        sequences = fetch_sequences(all_proteins)
         
         # Compute embeddings
         embeddings_cache = compute_esm_embeddings(
@@ -498,41 +936,76 @@ def train_model(
         
         # Save embeddings cache
         logger.info(f"Saving embeddings cache to {embeddings_cache_path}")
-        with open(embeddings_cache_path, 'wb') as f:
-            pickle.dump(embeddings_cache, f)
+        save_embeddings(embeddings_cache, embeddings_cache_path)
     
-    # Filter out pairs with missing embeddings
-    valid_pairs = []
-    valid_labels = []
-    for pair, label in zip(all_pairs, all_labels):
-        if pair[0] in embeddings_cache and pair[1] in embeddings_cache:
-            valid_pairs.append(pair)
-            valid_labels.append(label)
+    use_cuda = device == "cuda"
+    # Mixed precision on GPU: bf16 where supported (no loss scaling needed), else fp16 + GradScaler
+    amp_dtype = torch.bfloat16 if use_cuda and torch.cuda.is_bf16_supported() else torch.float16
     
-    logger.info(f"Valid pairs with embeddings: {len(valid_pairs)}")
+    # Single (num_proteins, 1280) embedding table; pairs become integer indices into it.
+    # On GPU it is uploaded once in the autocast dtype (~50 MB per 20k proteins) and
+    # batches are gathered on the device, so there are no per-batch feature copies
+    protein_index = pd.Index(list(embeddings_cache))
+    emb_table = torch.stack(list(embeddings_cache.values())).to(
+        device, amp_dtype if use_cuda else torch.float32
+    )
+    pair_idx = protein_index.get_indexer(all_pairs.ravel()).reshape(-1, 2)
+    
+    # Filter out pairs with missing embeddings (get_indexer returns -1)
+    valid = (pair_idx >= 0).all(axis=1)
+    pair_idx = pair_idx[valid].astype(np.int32)
+    valid_labels = all_labels[valid]
+    
+    logger.info(f"Valid pairs with embeddings: {len(valid_labels)}")
     
     # Split into train and test sets
-    train_pairs, test_pairs, train_labels, test_labels = train_test_split(
-        valid_pairs, valid_labels, test_size=test_size, random_state=42, stratify=valid_labels
+    train_idx, test_idx = train_test_split(
+        np.arange(len(valid_labels)), test_size=test_size, random_state=42, stratify=valid_labels
     )
     
     # Create datasets
-    train_dataset = PPIDataset(train_pairs, train_labels, embeddings_cache)
-    test_dataset = PPIDataset(test_pairs, test_labels, embeddings_cache)
+    train_dataset = PPIDataset(emb_table, pair_idx[train_idx], valid_labels[train_idx])
+    test_dataset = PPIDataset(emb_table, pair_idx[test_idx], valid_labels[test_idx])
     
-    # Create data loaders
-    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
-    test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False)
+    # Create data loaders; each batch is one gather from emb_table on its own device, so
+    # there is no I/O to hide behind workers or pinned staging
+    loader_kwargs = {"batch_size": None, "num_workers": 0}
+    train_loader = DataLoader(
+        train_dataset,
+        # Static batch shape on GPU so the compiled model's CUDA graph is never re-captured
+        sampler=BatchSampler(RandomSampler(train_dataset), batch_size=batch_size,
+                             drop_last=use_cuda and len(train_dataset) >= batch_size),
+        **loader_kwargs
+    )
+    test_loader = DataLoader(
+        test_dataset,
+        sampler=BatchSampler(SequentialSampler(test_dataset), batch_size=batch_size, drop_last=False),
+        **loader_kwargs
+    )
     
     # Initialize model
     model = PPIPredictor(input_dim=2560)  # 2 * 1280 (ESM2-650M embedding size)
     model = model.to(device)
+    # The compiled wrapper shares parameters with `model`; checkpoints come from `model`
+    # so state_dict keys carry no _orig_mod. prefix
+    train_step_model = model
+    if use_cuda:
+        # Replays the MLP forward/backward as CUDA graphs instead of ~12 tiny launches each
+        train_step_model = torch.compile(model, mode="reduce-overhead", fullgraph=True, dynamic=False)
     
     # Loss and optimizer
-    criterion = nn.BCELoss()
-    optimizer = optim.Adam(model.parameters(), lr=learning_rate)
+    criterion = nn.BCEWithLogitsLoss()
+    # Single fused kernel per step on GPU, multi-tensor (foreach) updates on CPU;
+    # weight_decay=0 keeps the previous Adam behaviour
+    optimizer = optim.AdamW(model.parameters(), lr=learning_rate, weight_decay=0.0,
+                            **({"fused": True} if use_cuda else {"foreach": True}))
     scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode='min', patience=3, factor=0.5)
     
+    scaler = torch.cuda.amp.GradScaler(enabled=use_cuda and amp_dtype == torch.float16)
+    if use_cuda:
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+    
     # Training loop
     logger.info("Starting training...")
     best_test_loss = float('inf')
@@ -540,49 +1013,63 @@ def train_model(
     for epoch in range(num_epochs):
         # Training
         model.train()
-        train_loss = 0.0
-        train_preds = []
-        train_true = []
+        # Loss and predictions stay on the device; one host sync per epoch for the metrics
+        train_loss = torch.zeros((), device=device)
+        train_preds = torch.empty(len(train_dataset), device=device)
+        train_true = torch.empty(len(train_dataset), device=device)
+        offset = 0
         
-        for batch in tqdm(train_loader, desc=f"Epoch {epoch+1}/{num_epochs}"):
-            embeddings = batch['embedding'].to(device)
-            labels = batch['label'].to(device)
+        optimizer.zero_grad(set_to_none=True)
+        for step, (embeddings, batch_labels) in enumerate(tqdm(train_loader, desc=f"Epoch {epoch+1}/{num_epochs}")):
+            embeddings = embeddings.to(device, non_blocking=True)
+            labels = batch_labels.to(device, non_blocking=True).float()
             
-            optimizer.zero_grad()
-            binary_prob, _ = model(embeddings)
-            loss = criterion(binary_prob.squeeze(), labels)
-            loss.backward()
-            optimizer.step()
+            with torch.autocast(device_type="cuda", dtype=amp_dtype, enabled=use_cuda):
+                binary_logit, _ = train_step_model(embeddings, return_type=False)
+                loss = criterion(binary_logit.squeeze(), labels)
+            scaler.scale(loss / grad_accum_steps).backward()
+            if (step + 1) % grad_accum_steps == 0 or step + 1 == len(train_loader):
+                scaler.step(optimizer)
+                scaler.update()
+                optimizer.zero_grad(set_to_none=True)
             
-            train_loss += loss.item()
-            train_preds.extend(binary_prob.squeeze().detach().cpu().numpy())
-            train_true.extend(labels.cpu().numpy())
+            train_loss += loss.detach()
+            train_preds[offset:offset + len(labels)] = binary_logit.detach().view(-1)
+            train_true[offset:offset + len(labels)] = labels
+            offset += len(labels)
         
-        train_loss /= len(train_loader)
-        train_acc = accuracy_score(train_true, [1 if p > 0.5 else 0 for p in train_preds])
-        train_auc = roc_auc_score(train_true, train_preds)
+        train_loss = train_loss.item() / len(train_loader)
+        train_preds, train_true = train_preds[:offset], train_true[:offset]
+        train_acc = ((train_preds > 0) == train_true.bool()).float().mean().item()
+        train_auc = roc_auc_score(train_true.cpu().numpy(), train_preds.cpu().numpy())
         
         # Validation
         model.eval()
-        test_loss = 0.0
-        test_preds = []
-        test_true = []
+        # On CPU validate a BN-folded copy (same eval outputs, no BN kernels); on GPU the
+        # compiled model already fuses BN into its neighbouring kernels
+        eval_model = train_step_model if use_cuda else fold_batchnorm(copy.deepcopy(model))
+        test_loss = torch.zeros((), device=device)
+        test_preds = torch.empty(len(test_dataset), device=device)
+        test_true = torch.empty(len(test_dataset), device=device)
+        offset = 0
         
         with torch.no_grad():
-            for batch in test_loader:
-                embeddings = batch['embedding'].to(device)
-                labels = batch['label'].to(device)
+            for embeddings, batch_labels in test_loader:
+                embeddings = embeddings.to(device, non_blocking=True)
+                labels = batch_labels.to(device, non_blocking=True).float()
                 
-                binary_prob, _ = model(embeddings)
-                loss = criterion(binary_prob.squeeze(), labels)
+                with torch.autocast(device_type="cuda", dtype=amp_dtype, enabled=use_cuda):
+                    binary_logit, _ = eval_model(embeddings, return_type=False)
+                    loss = criterion(binary_logit.squeeze(), labels)
                 
-                test_loss += loss.item()
-                test_preds.extend(binary_prob.squeeze().cpu().numpy())
-                test_true.extend(labels.cpu().numpy())
+                test_loss += loss
+                test_preds[offset:offset + len(labels)] = binary_logit.view(-1)
+                test_true[offset:offset + len(labels)] = labels
+                offset += len(labels)
         
-        test_loss /= len(test_loader)
-        test_acc = accuracy_score(test_true, [1 if p > 0.5 else 0 for p in test_preds])
-        test_auc = roc_auc_score(test_true, test_preds)
+        test_loss = test_loss.item() / len(test_loader)
+        test_acc = ((test_preds > 0) == test_true.bool()).float().mean().item()
+        test_auc = roc_auc_score(test_true.cpu().numpy(), test_preds.cpu().numpy())
         
         scheduler.step(test_loss)
         
@@ -593,9 +1080,11 @@ def train_model(
         # Save best model
         if test_loss < best_test_loss:
             best_test_loss = test_loss
+            # The embeddings live in their own memmap cache; reference it rather than
+            # re-pickling the whole table on every improvement
             torch.save({
                 'model_state_dict': model.state_dict(),
-                'embeddings_cache': embeddings_cache,
+                'emb_path': embeddings_cache_path,
                 'epoch': epoch,
                 'test_loss': test_loss,
                 'test_acc': test_acc,
@@ -605,12 +1094,8 @@ def train_model(
     
     logger.info("Training completed!")
     logger.info(f"Best model saved to {model_save_path}")
-    
-    # Save embeddings cache separately for inference
-    embeddings_save_path = "embeddings_cache.pkl"
-    with open(embeddings_save_path, 'wb') as f:
-        pickle.dump(embeddings_cache, f)
-    logger.info(f"Embeddings cache saved to {embeddings_save_path}")
+    # Embeddings cache was already written for inference when it was built
+    logger.info(f"Embeddings cache at {embeddings_cache_path} (+ .json index)")
 
 
 if __name__ == "__main__":
@@ -621,7 +1106,7 @@ if __name__ == "__main__":
                        help="Path to HINT dataset file")
     parser.add_argument("--model_save_path", type=str, default="model.pth",
                        help="Path to save trained model")
-    parser.add_argument("--embeddings_cache_path", type=str, default="embeddings_cache.pkl",
+    parser.add_argument("--embeddings_cache_path", type=str, default="embeddings_cache.mmap",
                        help="Path to embeddings cache file")
     parser.add_argument("--negative_ratio", type=float, default=1.0,
                        help="Ratio of negative to positive samples")
@@ -633,6 +1118,8 @@ if __name__ == "__main__":
                        help="Learning rate")
     parser.add_argument("--num_epochs", type=int, default=10,
                        help="Number of training epochs")
+    parser.add_argument("--grad_accum_steps", type=int, default=1,
+                       help="Batches to accumulate per optimizer step")
     parser.add_argument("--device", type=str, default=None,
                        help="Device to use (cuda/cpu)")
     
@@ -649,6 +1136,7 @@ if __name__ == "__main__":
         batch_size=args.batch_size,
         learning_rate=args.learning_rate,
         num_epochs=args.num_epochs,
-        device=device
+        device=device,
+        grad_accum_steps=args.grad_accum_steps
     )
 